@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Upload the current directory into a branch on GitHub using the Contents API.
+"""Upload the current directory into a branch on GitHub using the Git Data API.
 Environment variables:
   GITHUB_TOKEN (required)
   REPO (owner/repo) (optional, will prompt)
@@ -7,10 +7,11 @@ Environment variables:
   BASE_BRANCH (branch to base off, default: main)
   SOURCE_DIR (directory to upload, default: .)
 
-This script uses the GitHub Contents API to create/update files. It's intended to be runnable from iSH on iPhone, macOS, Linux, or CI runners.
+This script creates one blob per file, then a single tree, commit and ref update, so the whole upload lands as one atomic commit. It's intended to be runnable from iSH on iPhone, macOS, Linux, or CI runners.
 """
-import os, sys, json, base64, urllib.request, urllib.error
-from urllib.parse import quote
+import os, sys, stat, base64, hashlib, asyncio
+import aiohttp
+import aiofiles
 
 GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
 if not GITHUB_TOKEN:
@@ -31,80 +32,118 @@ headers = {
     'Accept': 'application/vnd.github+json'
 }
 
-def api_get(path):
-    req = urllib.request.Request(API_BASE + path, headers=headers, method='GET')
-    try:
-        with urllib.request.urlopen(req) as resp:
-            return json.load(resp)
-    except urllib.error.HTTPError as e:
-        return e
-
-def api_post(path, data):
-    data_b = json.dumps(data).encode('utf-8')
-    req = urllib.request.Request(API_BASE + path, data=data_b, headers={**headers, 'Content-Type': 'application/json'}, method='POST')
-    with urllib.request.urlopen(req) as resp:
-        return json.load(resp)
-
-def api_put(path, data):
-    data_b = json.dumps(data).encode('utf-8')
-    req = urllib.request.Request(API_BASE + path, data=data_b, headers={**headers, 'Content-Type': 'application/json'}, method='PUT')
-    with urllib.request.urlopen(req) as resp:
-        return json.load(resp)
-
-def ensure_branch():
+# GitHub doesn't like many concurrent writes; 8 in flight is a safe ceiling
+MAX_CONCURRENCY = 8
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+# path -> (blob sha, mode) of every file already on the branch, filled by load_existing_tree
+EXISTING_SHAS = {}
+SKIP_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', '.mypy_cache', 'dist', 'build'}
+
+def new_session():
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY, limit_per_host=MAX_CONCURRENCY)
+    # per socket operation, not whole request: large blobs on slow links can take well over 30s
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+    return aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
+
+async def api_request(session, method, path, data=None):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.request(method, API_BASE + path, json=data) as resp:
+                if resp.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    continue
+                if resp.status >= 400:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status,
+                        message=await resp.text(), headers=resp.headers)
+                return await resp.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+async def api_get(session, path):
+    return await api_request(session, 'GET', path)
+
+async def api_post(session, path, data):
+    return await api_request(session, 'POST', path, data)
+
+async def api_patch(session, path, data):
+    return await api_request(session, 'PATCH', path, data)
+
+async def ensure_branch(session):
     # get base branch sha
     print(f'Ensuring branch {BRANCH} exists (base: {BASE_BRANCH})...')
-    r = api_get(f'/repos/{REPO}/git/ref/heads/{BASE_BRANCH}')
-    if isinstance(r, Exception):
-        print('Failed to fetch base branch info:', r)
+    try:
+        r = await api_get(session, f'/repos/{REPO}/git/ref/heads/{BASE_BRANCH}')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print('Failed to fetch base branch info:', e)
         sys.exit(3)
     base_sha = r['object']['sha']
     # try to create branch
-    existing = api_get(f'/repos/{REPO}/git/ref/heads/{BRANCH}')
-    if not isinstance(existing, Exception):
+    try:
+        existing = await api_get(session, f'/repos/{REPO}/git/ref/heads/{BRANCH}')
         print('Branch already exists.')
-        return
+        return existing['object']['sha']
+    except aiohttp.ClientResponseError:
+        pass
     payload = {'ref': f'refs/heads/{BRANCH}', 'sha': base_sha}
     try:
-        api_post(f'/repos/{REPO}/git/refs', payload)
+        await api_post(session, f'/repos/{REPO}/git/refs', payload)
         print('Branch created.')
     except Exception as e:
         print('Failed to create branch:', e)
         sys.exit(4)
+    return base_sha
 
-def upload_file(path_on_disk, relpath):
-    with open(path_on_disk, 'rb') as f:
-        content = f.read()
-    content_b64 = base64.b64encode(content).decode('utf-8')
-    # check if file exists on branch
-    try:
-        existing = api_get(f'/repos/{REPO}/contents/{quote(relpath)}?ref={BRANCH}')
-        if isinstance(existing, Exception):
-            raise Exception('not found')
-        sha = existing.get('sha')
-    except Exception:
-        sha = None
-    message = f"{COMMIT_PREFIX} add {relpath}"
-    payload = {'message': message, 'content': content_b64, 'branch': BRANCH}
-    if sha:
-        payload['sha'] = sha
-    try:
-        res = api_put(f'/repos/{REPO}/contents/{quote(relpath)}', payload)
+async def load_existing_tree(session, branch_sha):
+    # one recursive listing instead of a lookup per file; also gives us the base tree
+    tree = await api_get(session, f'/repos/{REPO}/git/trees/{branch_sha}?recursive=1')
+    EXISTING_SHAS.update({e['path']: (e['sha'], e['mode']) for e in tree['tree'] if e['type'] == 'blob'})
+    return tree['sha']
+
+def git_blob_sha(data):
+    # same sha git computes for a blob object, so it compares directly with the remote tree
+    h = hashlib.sha1(usedforsecurity=False)
+    h.update(f'blob {len(data)}\0'.encode())
+    h.update(data)
+    return h.hexdigest()
+
+async def create_blob(session, sem, path_on_disk, relpath):
+    async with sem:
+        async with aiofiles.open(path_on_disk, 'rb') as f:
+            content = await f.read()
+        mode = '100755' if os.stat(path_on_disk).st_mode & stat.S_IXUSR else '100644'
+        local_sha = git_blob_sha(content)
+        existing = EXISTING_SHAS.get(relpath)
+        if existing == (local_sha, mode):
+            print('Unchanged', relpath)
+            return None
+        if existing and existing[0] == local_sha:
+            # only the mode changed; the blob is already there, so just point a new entry at it
+            print('Mode changed', relpath)
+            return {'path': relpath, 'mode': mode, 'type': 'blob', 'sha': local_sha}
+        content_b64 = base64.b64encode(content).decode('utf-8')
+        payload = {'content': content_b64, 'encoding': 'base64'}
+        blob = await api_post(session, f'/repos/{REPO}/git/blobs', payload)
         print('Uploaded', relpath)
-    except urllib.error.HTTPError as e:
-        print('Failed to upload', relpath, 'status', e.code)
-        print(e.read().decode())
-        sys.exit(5)
+        return {'path': relpath, 'mode': mode, 'type': 'blob', 'sha': blob['sha']}
+
+async def commit_tree(session, branch_sha, base_tree_sha, entries):
+    tree = await api_post(session, f'/repos/{REPO}/git/trees',
+                          {'base_tree': base_tree_sha, 'tree': entries})
+    message = f"{COMMIT_PREFIX} upload {len(entries)} files"
+    commit = await api_post(session, f'/repos/{REPO}/git/commits',
+                            {'message': message, 'tree': tree['sha'], 'parents': [branch_sha]})
+    await api_patch(session, f'/repos/{REPO}/git/refs/heads/{BRANCH}', {'sha': commit['sha']})
+    return commit['sha']
 
-def main():
-    ensure_branch()
+async def main():
     files = []
-    for root, dirs, filenames in os.walk(SOURCE_DIR):
-        # skip .git and node_modules and __pycache__
-        if '.git' in root.split(os.sep):
-            continue
-        if root.startswith('./.git') or '/.git' in root:
-            continue
+    for root, dirs, filenames in os.walk(SOURCE_DIR, followlinks=False):
+        # prune in place so os.walk never descends into these
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
         for fn in filenames:
             # skip zip output if present
             if fn.endswith('.zip'):
@@ -113,9 +152,30 @@ def main():
             full = os.path.join(root, fn)
             rel = os.path.relpath(full, SOURCE_DIR)
             files.append((full, rel.replace('\\','/')))
-    # Upload each file
-    for full, rel in files:
-        upload_file(full, rel)
+    # Create blobs concurrently, bounded by the semaphore, then commit them in one go
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with new_session() as session:
+        branch_sha = await ensure_branch(session)
+        base_tree_sha = await load_existing_tree(session, branch_sha)
+        tasks = [create_blob(session, sem, full, rel) for full, rel in files]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        failed = [(rel, r) for (_, rel), r in zip(files, results) if isinstance(r, BaseException)]
+        for rel, e in failed:
+            print('Failed to upload', rel, f'({type(e).__name__}: {e})')
+        if failed:
+            sys.exit(5)
+        # unchanged files are left out; base_tree carries them over
+        entries = [r for r in results if r is not None]
+        if not entries:
+            print('Nothing to upload.')
+            return
+        try:
+            commit_sha = await commit_tree(session, branch_sha, base_tree_sha, entries)
+        except aiohttp.ClientResponseError as e:
+            print('Failed to commit tree, status', e.status)
+            print(e.message)
+            sys.exit(6)
+    print(f'Committed {len(entries)} files to {BRANCH} ({commit_sha}), {len(results) - len(entries)} unchanged.')
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
@@ -1,9 +1,22 @@
 from flask import Flask, Response, request
 from prometheus_client import generate_latest, Gauge, CollectorRegistry
-from github import Github
-import os, time, json, requests
+from datetime import datetime, timezone
+import os, time, hmac, hashlib, threading, collections, requests
+import ijson
+import orjson
 
-G = Github(os.environ.get('GITHUB_TOKEN', ''))
+API_BASE = 'https://api.github.com'
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN', '')
+
+_session = requests.Session()
+_session.headers.update({'Accept': 'application/vnd.github+json'})
+if GITHUB_TOKEN:
+    _session.headers['Authorization'] = f'token {GITHUB_TOKEN}'
+
+# url -> (etag, parsed value); a 304 reply costs no rate limit and has no body
+_etag_cache = {}
+# (mtime_ns, size) of the last parsed Trivy report and its severity counts
+_trivy_cache = (None, {})
 
 app = Flask(__name__)
 REG = CollectorRegistry()
@@ -12,39 +25,142 @@ g_open_issues = Gauge('webssh_open_issues_count', 'open issues count', registry=
 g_trivy_vulns = Gauge('webssh_trivy_vulnerabilities_total', 'trivy vuln count', ['severity'], registry=REG)
 
 REPO = os.environ.get('REPO','isontheline/pro.webssh.net')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '').encode()
+# with webhooks pushing updates, polling only has to be a slow safety net
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', '3600' if WEBHOOK_SECRET else '60'))
+TRIVY_PATH = os.environ.get('TRIVY_PATH','/data/reports/trivy.json')
 
-def update_metrics():
-    repo = G.get_repo(REPO)
+# held while gauges are written or exported so a scrape never sees a half-applied refresh
+_lock = threading.Lock()
+
+def _conditional_get(path, parse, params=None):
+    """GET an API path with If-None-Match, reusing the cached value on 304."""
+    url = requests.Request('GET', API_BASE + path, params=params).prepare().url
+    cached = _etag_cache.get(url)
+    req_headers = {'If-None-Match': cached[0]} if cached else {}
+    resp = _session.get(url, headers=req_headers, timeout=30)
+    if resp.status_code == 304:
+        return cached[1]
+    resp.raise_for_status()
+    value = parse(resp)
+    if 'ETag' in resp.headers:
+        _etag_cache[url] = (resp.headers['ETag'], value)
+    return value
+
+def _parse_timestamp(value):
+    dt = datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def _release_timestamp(resp):
+    return _parse_timestamp(orjson.loads(resp.content)['published_at'])
+
+def _issue_count(resp):
+    # the issues endpoint also lists PRs; search counts real issues in one small response
+    return orjson.loads(resp.content)['total_count']
+
+def _trivy_counts():
+    global _trivy_cache
     try:
-        release = repo.get_latest_release()
-        g_latest_release.set(int(release.published_at.timestamp()))
+        st = os.stat(TRIVY_PATH)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == _trivy_cache[0]:
+            return _trivy_cache[1]
+        with open(TRIVY_PATH, 'rb') as f:
+            vulns = ijson.items(f, 'Results.item.Vulnerabilities.item')
+            counts = dict(collections.Counter(v.get('Severity','UNKNOWN') for v in vulns))
     except Exception:
-        g_latest_release.set(0)
-    issues = repo.get_issues(state='open')
-    g_open_issues.set(issues.totalCount)
+        return {}
+    _trivy_cache = (stamp, counts)
+    return counts
 
-    trivy_path = os.environ.get('TRIVY_PATH','/data/reports/trivy.json')
+def update_metrics():
+    # each source is fetched on its own; a failed one keeps its previous gauge value
+    release_ts = None
     try:
-        with open(trivy_path) as f:
-            data = json.load(f)
-            counts = {}
-            for vulnset in data.get('Results', []):
-                for v in vulnset.get('Vulnerabilities', []) or []:
-                    sev = v.get('Severity','UNKNOWN')
-                    counts[sev] = counts.get(sev,0) + 1
-            for s,c in counts.items():
-                g_trivy_vulns.labels(severity=s).set(c)
-    except Exception:
-        pass
+        release_ts = _conditional_get(f'/repos/{REPO}/releases/latest', _release_timestamp)
+    except requests.HTTPError as e:
+        if e.response.status_code == 404:
+            release_ts = 0  # no releases yet
+        else:
+            app.logger.warning('latest release fetch failed: %s', e)
+    except Exception as e:
+        app.logger.warning('latest release fetch failed: %s', e)
+
+    open_issues = None
+    try:
+        open_issues = _conditional_get('/search/issues', _issue_count,
+                                       params={'q': f'repo:{REPO} is:issue is:open', 'per_page': 1})
+    except Exception as e:
+        app.logger.warning('open issue count fetch failed: %s', e)
+
+    counts = _trivy_counts()
+
+    with _lock:
+        if release_ts is not None:
+            g_latest_release.set(release_ts)
+        if open_issues is not None:
+            g_open_issues.set(open_issues)
+        for s,c in counts.items():
+            g_trivy_vulns.labels(severity=s).set(c)
+
+def _refresh_loop():
+    while True:
+        try:
+            update_metrics()
+        except Exception as e:
+            app.logger.warning('metrics refresh failed: %s', e)
+        time.sleep(REFRESH_INTERVAL)
+
+threading.Thread(target=_refresh_loop, daemon=True).start()
 
 @app.route('/metrics')
 def metrics():
-    update_metrics()
-    return Response(generate_latest(REG), mimetype='text/plain; version=0.0.4')
+    with _lock:
+        body = generate_latest(REG)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+def _valid_signature(body, signature):
+    if not WEBHOOK_SECRET or not signature:
+        return False
+    expected = 'sha256=' + hmac.new(WEBHOOK_SECRET, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
 
 @app.route('/ingest', methods=['POST'])
 def ingest():
-    payload = request.get_json(force=True)
+    body = request.get_data()
+    if not _valid_signature(body, request.headers.get('X-Hub-Signature-256', '')):
+        return ('invalid signature', 403)
+    event = request.headers.get('X-GitHub-Event', '')
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    action = payload.get('action')
+
+    try:
+        if event == 'release' and action in ('published', 'released'):
+            release = payload['release']
+            # /releases/latest, which the poller reads, ignores prereleases and drafts
+            if not (release.get('prerelease') or release.get('draft')):
+                ts = _parse_timestamp(release['published_at'])
+                with _lock:
+                    g_latest_release.set(ts)
+        elif event == 'issues':
+            deleted_open = action == 'deleted' and payload['issue']['state'] == 'open'
+            with _lock:
+                if action in ('opened', 'reopened'):
+                    g_open_issues.inc()
+                elif action == 'closed' or deleted_open:
+                    g_open_issues.dec()
+        elif event == 'trivy_scan_complete':
+            counts = _trivy_counts()
+            with _lock:
+                for s,c in counts.items():
+                    g_trivy_vulns.labels(severity=s).set(c)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return ('malformed payload', 400)
     return ('',204)
 
 if __name__ == '__main__':
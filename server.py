@@ -1,10 +1,37 @@
 from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-import json
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import logging
 import os
+import aiofiles
+import orjson
+
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
 MEMORY_PATH = "../memory/codex_embeddings.json"
+# parsed memory file, reloaded only when its mtime differs from the one we last saw;
+# "pending" holds inserts not yet on disk so a reload can't drop them
+_memory_cache = {"mtime": None, "data": {}, "pending": {}}
+# held while the file is reloaded or flushed so a reload never races a write
+_memory_lock = asyncio.Lock()
+# set by inserts; the flusher coalesces everything that arrives within FLUSH_DELAY into one write
+_dirty = asyncio.Event()
+FLUSH_DELAY = 0.2
+FLUSH_RETRY_DELAY = 5
+
+@asynccontextmanager
+async def lifespan(app):
+    flusher = asyncio.create_task(_flush_loop())
+    yield
+    flusher.cancel()
+    with suppress(asyncio.CancelledError):
+        await flusher
+    # covers both inserts still waiting and a write the cancel interrupted
+    if _memory_cache["pending"]:
+        await _flush()
+
+app = FastAPI(lifespan=lifespan)
 
 class MemoryEntry(BaseModel):
     key: str
@@ -14,23 +41,76 @@ class MemoryEntry(BaseModel):
 def read_root():
     return {"status": "Prometheus HAL API Online"}
 
+def _memory_mtime():
+    try:
+        return os.stat(MEMORY_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+async def _load():
+    """Return the cached memory dict, or None if there is no memory file yet."""
+    if _memory_mtime() != _memory_cache["mtime"]:
+        async with _memory_lock:
+            mtime = _memory_mtime()
+            if mtime != _memory_cache["mtime"]:
+                data = {}
+                if mtime is not None:
+                    async with aiofiles.open(MEMORY_PATH, "rb") as f:
+                        data = orjson.loads(await f.read())
+                data.update(_memory_cache["pending"])
+                _memory_cache["data"] = data
+                _memory_cache["mtime"] = mtime
+    if _memory_cache["mtime"] is None and not _memory_cache["data"]:
+        return None
+    return _memory_cache["data"]
+
+async def _flush():
+    async with _memory_lock:
+        written = dict(_memory_cache["pending"])
+        data = orjson.dumps(_memory_cache["data"], option=orjson.OPT_INDENT_2)
+        # write to a temp file and swap it in so readers never see a partial file
+        tmp_path = MEMORY_PATH + ".tmp"
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(data)
+            os.replace(tmp_path, MEMORY_PATH)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        _memory_cache["mtime"] = _memory_mtime()
+        pending = _memory_cache["pending"]
+        for key, value in written.items():
+            # keys re-inserted with a new value during the write stay pending
+            if pending.get(key) == value:
+                del pending[key]
+
+async def _flush_loop():
+    while True:
+        await _dirty.wait()
+        await asyncio.sleep(FLUSH_DELAY)
+        # clear before writing so inserts that land mid-write schedule another flush
+        _dirty.clear()
+        try:
+            await _flush()
+        except Exception:
+            logger.exception("Failed to flush %s, retrying", MEMORY_PATH)
+            _dirty.set()
+            await asyncio.sleep(FLUSH_RETRY_DELAY)
+
 @app.get("/memory/{key}")
-def get_memory(key: str):
-    if not os.path.exists(MEMORY_PATH):
+async def get_memory(key: str):
+    memory = await _load()
+    if memory is None:
         raise HTTPException(status_code=404, detail="Memory file not found")
-    with open(MEMORY_PATH, "r") as f:
-        memory = json.load(f)
     return {"value": memory.get(key, "Not Found")}
 
 @app.post("/memory")
-def insert_memory(entry: MemoryEntry):
-    memory = {}
-    if os.path.exists(MEMORY_PATH):
-        with open(MEMORY_PATH, "r") as f:
-            memory = json.load(f)
-    memory[entry.key] = entry.value
-    with open(MEMORY_PATH, "w") as f:
-        json.dump(memory, f, indent=4)
+async def insert_memory(entry: MemoryEntry):
+    await _load()
+    _memory_cache["data"][entry.key] = entry.value
+    _memory_cache["pending"][entry.key] = entry.value
+    _dirty.set()
     return {"status": "inserted", "key": entry.key}
 
 @app.get("/hal/ping")
@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def memory_file(tmp_path, monkeypatch):
+    path = tmp_path / "codex_embeddings.json"
+    path.write_bytes(orjson.dumps({"a": "1"}))
+    monkeypatch.setattr(server, "MEMORY_PATH", str(path))
+    # only the shutdown flush should write, so the test controls the ordering
+    monkeypatch.setattr(server, "FLUSH_DELAY", 60)
+    monkeypatch.setattr(server, "_memory_cache", {"mtime": None, "data": {}, "pending": {}})
+    monkeypatch.setattr(server, "_memory_lock", asyncio.Lock())
+    monkeypatch.setattr(server, "_dirty", asyncio.Event())
+    return path
+
+
+def test_pending_insert_survives_external_change(memory_file):
+    with TestClient(server.app) as client:
+        assert client.get("/memory/a").json() == {"value": "1"}
+        assert client.post("/memory", json={"key": "pending", "value": "x"}).status_code == 200
+
+        # someone else rewrites the file before our insert has been flushed
+        memory_file.write_bytes(orjson.dumps({"a": "1", "ext": "y"}))
+        st = os.stat(memory_file)
+        os.utime(memory_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+        assert client.get("/memory/pending").json() == {"value": "x"}
+        assert client.get("/memory/ext").json() == {"value": "y"}
+
+    assert orjson.loads(memory_file.read_bytes()) == {"a": "1", "ext": "y", "pending": "x"}
+    assert server._memory_cache["pending"] == {}